@@ -1,4 +1,10 @@
 import argparse
+import concurrent.futures
+import functools
+import hashlib
+import heapq
+import locale
+import math
 import os
 import pathlib
 import re
@@ -6,11 +12,49 @@ import subprocess
 import sys
 import tempfile
 import textwrap
+from collections.abc import Iterable
+from collections.abc import Iterator
 
 import yaml
 
 from ._version import version
 
+_DOXYGEN_KEYS = (
+    "author",
+    "brief",
+    "code",
+    "copydoc",
+    "copyright",
+    "endcode",
+    "file",
+    "note",
+    "param",
+    "return",
+    "throws",
+    "tparam",
+    "warning",
+)
+
+
+@functools.lru_cache(maxsize=64)
+def _compiled_bracket(
+    opening: str, closing: str, escape_input: bool
+) -> tuple[re.Pattern, re.Pattern]:
+    """
+    Compiled patterns matching an opening and a closing 'bracket', see :py:func:`find_matching`.
+    Escaped brackets are matched too, they are filtered by the caller
+    (a leading lookbehind prevents the regex engine from using a fast prefix search).
+    """
+
+    if escape_input:
+        opening = re.escape(opening)
+        closing = re.escape(closing)
+
+    return re.compile(opening), re.compile(closing)
+
+
+_RE_CODEBLOCK = _compiled_bracket(r"([\@\\])(code{\.cpp})", r"([\@\\])(endcode)", False)
+
 
 def find_matching(
     text: str,
@@ -30,83 +74,236 @@ def find_matching(
     :param closing: The closing bracket (e.g. ``")"``, ``"]"``, ``"}"``).
     :param escape_input: If ``True``, escape the input string (e.g. ``"\"`` becomes ``"\\\"``).
     :param ignore_escaped: Ignore escaped bracket (e.g. ``"\("``, ``"\)"``, etc).
+    :return: Dictionary with ``{index_opening: index_closing}``, ordered by ``index_opening``.
+    """
+
+    if escape_input and len(opening) > 0 and len(closing) > 0:
+        return _find_matching_literal(text, opening, closing, ignore_escaped)
+
+    patterns = _compiled_bracket(opening, closing, escape_input)
+    return _find_matching_compiled(text, patterns, ignore_escaped)
+
+
+def _find_matching_literal(
+    text: str, opening: str, closing: str, ignore_escaped: bool = True
+) -> dict[int, int]:
+    r"""
+    Find matching literal 'brackets' using :py:meth:`str.find`, see :py:func:`find_matching`.
+
+    :param text: The string to consider.
+    :param opening: The opening bracket (e.g. ``"/**"``).
+    :param closing: The closing bracket (e.g. ``"*/"``).
+    :param ignore_escaped: Ignore escaped bracket (e.g. ``"\("``, ``"\)"``, etc).
     :return: Dictionary with ``{index_opening: index_closing}``
     """
 
-    a = []
-    b = []
+    ret = {}
+    stack = []
+    o = text.find(opening)
+    c = text.find(closing)
+
+    # openings and closings are searched independently: they may overlap (e.g. ``"/**/"``)
+    while o >= 0 or c >= 0:
+        if o >= 0 and (c < 0 or o <= c):
+            if ignore_escaped and o > 0 and text[o - 1] == "\\":
+                o = text.find(opening, o + 1)
+                continue
+            stack.append(o)
+            ret[o] = None  # reserve the entry: keys are ordered by opening position
+            o = text.find(opening, o + len(opening))
+        else:
+            if ignore_escaped and c > 0 and text[c - 1] == "\\":
+                c = text.find(closing, c + 1)
+                continue
+            if len(stack) > 0:
+                ret[stack.pop()] = c
+            c = text.find(closing, c + len(closing))
 
-    if escape_input:
-        o = re.escape(opening)
-        c = re.escape(closing)
-    else:
-        o = opening
-        c = closing
+    if len(stack) > 0:
+        raise IndexError(f"No closing for opening at {stack.pop():d}")
 
-    if ignore_escaped:
-        o = r"(?<!\\)" + o
-        c = r"(?<!\\)" + c
+    return ret
 
-    for i in re.finditer(o, text):
-        a.append(i.span()[0])
 
-    for i in re.finditer(c, text):
-        b.append(-1 * i.span()[0])
+def _bracket_positions(text: str, pattern: re.Pattern, ignore_escaped: bool = True) -> list[int]:
+    r"""
+    Start positions of all (non-overlapping) matches of a 'bracket'.
 
-    if len(a) == 0 and len(b) == 0:
-        return {}
+    :param text: The string to consider.
+    :param pattern: Compiled pattern of the bracket.
+    :param ignore_escaped: Ignore escaped bracket (e.g. ``"\("``, ``"\)"``, etc).
+    :return: List of positions.
+    """
 
-    brackets = sorted(a + b, key=lambda i: abs(i))
+    ret = []
+    pos = 0
 
+    while True:
+        for match in pattern.finditer(text, pos):
+            start = match.start()
+            if ignore_escaped and start > 0 and text[start - 1] == "\\":
+                pos = start + 1  # restart the search just after the escaped bracket
+                break
+            ret.append(start)
+        else:
+            return ret
+
+
+def _find_matching_compiled(
+    text: str, patterns: tuple[re.Pattern, re.Pattern], ignore_escaped: bool = True
+) -> dict[int, int]:
+    r"""
+    Find matching 'brackets' using patterns from :py:func:`_compiled_bracket`,
+    see :py:func:`find_matching`.
+    Openings and closings are searched independently, such that they may overlap
+    (e.g. ``"/**/"``).
+
+    :param text: The string to consider.
+    :param patterns: Compiled patterns of the opening and the closing bracket.
+    :param ignore_escaped: Ignore escaped bracket (e.g. ``"\("``, ``"\)"``, etc).
+    :return: Dictionary with ``{index_opening: index_closing}``
+    """
+
+    opening, closing = patterns
     ret = {}
     stack = []
 
-    for i in brackets:
-        if i >= 0:
-            stack.append(i)
-        else:
-            if len(stack) == 0:
-                continue
-            j = stack.pop()
-            ret[j] = -1 * i
+    # at equal position an opening precedes a closing
+    brackets = heapq.merge(
+        ((i, False) for i in _bracket_positions(text, opening, ignore_escaped)),
+        ((i, True) for i in _bracket_positions(text, closing, ignore_escaped)),
+    )
+
+    for start, is_closing in brackets:
+        if not is_closing:
+            stack.append(start)
+            ret[start] = None  # reserve the entry: keys are ordered by opening position
+        elif len(stack) > 0:
+            ret[stack.pop()] = start
 
     if len(stack) > 0:
-        raise IndexError(f"No opening {opening} at {stack.pop():d}")
+        raise IndexError(f"No closing for opening at {stack.pop():d}")
 
     return ret
 
 
-def _comment_blocks(text: str, opening: str, closing: str, escape_input: bool) -> dict:
+def _comment_blocks(text: str, patterns: tuple[re.Pattern, re.Pattern]) -> dict[int, int]:
     """
     Find comment blocks in text.
 
     :param text: The string to consider.
-    :param opening: The opening symbol (e.g. ``"/**"``).
-    :param closing: The closing symbol (e.g. "*/").
-    :param escape_input: If ``True``, escape the input string (e.g. ``"\"`` becomes ``"\\\"``).
+    :param patterns: Compiled opening and closing patterns, see :py:func:`_compiled_bracket`.
     :return: Dictionary with ``{line_start: line_end}``
     """
 
-    brackets = find_matching(text, opening, closing, escape_input=escape_input)
-    opening_chars = sorted(list(brackets.keys()))
-    newline = [i for i, c in enumerate(text) if c == "\n"]
+    brackets = _find_matching_compiled(text, patterns)
 
     ret = {}
-    inewline = 0
-
-    for opening_char in opening_chars:
-        while opening_char > newline[inewline]:
-            inewline += 1
-        start_line = inewline
-        while brackets[opening_char] > newline[inewline]:
-            inewline += 1
-        inewline += 1
-        end_line = inewline
-        ret[start_line] = end_line
+    line = 0  # line number of "pos": newlines are counted incrementally between brackets
+    pos = 0
+
+    for opening_char, closing_char in brackets.items():
+        if opening_char >= pos:
+            line += text.count("\n", pos, opening_char)
+        else:
+            line -= text.count("\n", opening_char, pos)
+        start_line = line
+        line += text.count("\n", opening_char, closing_char)
+        pos = closing_char
+        ret[start_line] = line + 1
 
     return ret
 
 
+class Docstrings:
+    """
+    Class to format docstrings.
+    From this class, one can loop over all docstrings in a file and format them. E.g.::
+
+        docstrings = Docstrings(code)
+
+        for i, doc in enumerate(docstrings):
+            doc = ...
+            docstrings[i] = doc
+
+        formatted_code = str(docstrings)
+
+    :param text: The source code.
+    :param opening: The opening symbol of the docstring (e.g. ``"/**"``).
+    :param closing: The closing symbol of the docstring (e.g. ``"/*"``).
+    :param escape_input: If ``True``, escape the input string (e.g. ``"\"`` becomes ``"\\\"``).
+    """
+
+    def __init__(
+        self,
+        text: str,
+        opening: str = "/\\*\\*\\s*\n",
+        closing: str = r"\*/",
+        escape_input: bool = False,
+    ):
+        self._lines = text.split("\n")
+        patterns = _compiled_bracket(opening, closing, escape_input)
+        doc_blocks = _comment_blocks(text, patterns)
+        self._ranges = list(doc_blocks.items())
+        self._blocks = {}
+
+    def __len__(self) -> int:
+        return len(self._ranges)
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self._ranges)):
+            yield self[i]
+
+    def __setitem__(self, i: int, value: str):
+        self.set_lines(i, value.split("\n"))
+
+    def __getitem__(self, i: int) -> str:
+        return "\n".join(self.get_lines(i))
+
+    def get_lines(self, i: int) -> list[str]:
+        """
+        Lines of a docstring.
+
+        :param i: Index of the docstring.
+        :return: List of lines (without newline characters).
+        """
+        i = range(len(self._ranges))[i]
+
+        if i in self._blocks:
+            return list(self._blocks[i])
+
+        start, end = self._ranges[i]
+        return self._lines[start:end]
+
+    def set_lines(self, i: int, lines: list[str]):
+        """
+        Replace a docstring by a list of lines.
+        The source lines are left untouched, the replacement is only applied by :py:meth:`__str__`.
+
+        :param i: Index of the docstring.
+        :param lines: List of lines (without newline characters).
+        """
+        i = range(len(self._ranges))[i]  # normalise negative index, raise IndexError if invalid
+        self._blocks[i] = list(lines)
+
+    def __str__(self) -> str:
+        if len(self._blocks) == 0:
+            return "\n".join(self._lines)
+
+        ret = []
+        cursor = 0
+
+        for i, (start, end) in enumerate(self._ranges):
+            if i not in self._blocks:
+                continue
+            ret.extend(self._lines[cursor:start])
+            ret.extend(self._blocks[i])
+            cursor = end
+
+        ret.extend(self._lines[cursor:])
+        return "\n".join(ret)
+
+
 class _FormatLineDoxygen:
     """
     Support class to format doxygen commands.
@@ -119,44 +316,38 @@ class _FormatLineDoxygen:
         replace.remove(prefix)
         self.replace = [re.escape(i) for i in replace]
         self.prefix = re.escape(prefix)
+        self._fused = re.compile(
+            rf"^([^\S\n]*\*[^\S\n]*)(?:{'|'.join(self.replace)})({'|'.join(_DOXYGEN_KEYS)})",
+            re.MULTILINE,
+        )
+        self._repl = rf"\1{self.prefix}\2"
 
-    def format_line_javadoc(self, line):
+    def format_lines_javadoc(self, lines: list[str]) -> list[str]:
         """
-        Format a line of comment.
+        Format lines of comment.
+        All lines are substituted in one pass over the joined lines.
 
-        :param line: Comment line.
+        :param lines: Comment lines.
         :return: Formatted input.
         """
 
-        ret = line
-
-        for symbol in self.replace:
-            for key in [
-                "author",
-                "brief",
-                "code",
-                "copydoc",
-                "copydoc",
-                "copyright",
-                "endcode",
-                "file",
-                "note",
-                "param",
-                "return",
-                "throws",
-                "tparam",
-                "warning",
-            ]:
-                ret = re.sub(
-                    rf"^(\s*)(\*\s*)({symbol}{key})(.*)$",
-                    rf"\1\2{self.prefix}{key}\4",
-                    ret,
-                )
+        if len(lines) == 0:
+            return lines
 
-        return ret
+        return self._fused.sub(self._repl, "\n".join(lines)).split("\n")
+
+
+@functools.lru_cache(maxsize=None)
+def _format_line_doxygen(prefix: str) -> _FormatLineDoxygen:
+    """
+    Shared :py:class:`_FormatLineDoxygen` instance, such that its pattern is compiled only once.
+
+    :param prefix: The prefix to use (e.g. "@").
+    """
+    return _FormatLineDoxygen(prefix)
 
 
-def _format_javadoc_doxygen(text: str, doxygen_prefix: str) -> str:
+def _format_javadoc_doxygen(text: str, doxygen_prefix: str, docstrings: Docstrings = None) -> str:
     """
     Format docstrings according to javadoc/doxygen conventions::
 
@@ -165,34 +356,45 @@ def _format_javadoc_doxygen(text: str, doxygen_prefix: str) -> str:
          *
          * @param a This is a parameter.
          */
+
+    :param text: Source code.
+    :param doxygen_prefix: The prefix of doxygen commands (e.g. ``"@"``).
+    :param docstrings: Docstrings of ``text``, modified in place (``text`` is then ignored).
+    :return: Formatted source code.
     """
 
-    doxygen = _FormatLineDoxygen(doxygen_prefix)
-    docstrings = Docstrings(text)
+    if docstrings is None:
+        if "/**" not in text:
+            return text
+        docstrings = Docstrings(text)
 
-    for iblock, doc in enumerate(docstrings):
-        block = doc.split("\n")
-        indent = len(block[0].split("/**")[0])
-        block[-1] = " " * indent + " */"
+    doxygen = _format_line_doxygen(doxygen_prefix)
 
-        for i in range(1, len(block) - 1):
-            if re.match(r"^\s*$", block[i]):
-                block[i] = " " * indent + " *"
-            elif not re.match(r"^\s*\*", block[i]) or re.match(r"^\s*\*\*\w*.*", block[i]):
-                _, ind, cmd, _ = re.split(r"^(\s*)(.*)$", block[i])
-                block[i] = " " * indent + " * " + " " * (len(ind) - indent) + cmd
-            elif re.match(r"^\s*\*.*", block[i]):
-                _, ind, _, cmd, _ = re.split(r"^(\s*)(\*)(.*)$", block[i])
-                block[i] = " " * indent + " *" + cmd
+    for iblock in range(len(docstrings)):
+        block = docstrings.get_lines(iblock)
+        indent = block[0].find("/**")
+        star = " " * indent + " *"
+        block[-1] = star + "/"
 
-            block[i] = doxygen.format_line_javadoc(block[i])
+        for i in range(1, len(block) - 1):
+            stripped = block[i].lstrip()
+            if len(stripped) == 0:
+                block[i] = star
+            elif stripped[0] != "*" or stripped.startswith("**"):
+                ind = len(block[i]) - len(stripped)
+                block[i] = star + " " * (1 + max(ind - indent, 0)) + stripped
+            else:
+                block[i] = star + stripped[1:]
 
-        docstrings[iblock] = "\n".join(block)
+        block[1:-1] = doxygen.format_lines_javadoc(block[1:-1])
+        docstrings.set_lines(iblock, block)
 
     return str(docstrings)
 
 
-def _format_javadoc_internal_indent(text: str, tabsize: int = None) -> str:
+def _format_javadoc_internal_indent(
+    text: str, tabsize: int = None, docstrings: Docstrings = None
+) -> str:
     """
     Fix indentation of indented code inside javadoc comment blocks, that are formatted::
 
@@ -206,131 +408,61 @@ def _format_javadoc_internal_indent(text: str, tabsize: int = None) -> str:
 
     :param text: Source code.
     :param tabsize: The global tab size (default: extract automatically).
+    :param docstrings: Docstrings of ``text``, modified in place (``text`` is then ignored).
     :return: Source code with fixed indentation.
     """
 
-    docstrings = Docstrings(text)
+    if docstrings is None:
+        if "/**" not in text:
+            return text
+        docstrings = Docstrings(text)
 
     if tabsize is None:
         indent = []
-        for doc in docstrings:
-            indent.append(len(doc.split("/**")[0]))
+        for iblock in range(len(docstrings)):
+            indent.append(docstrings.get_lines(iblock)[0].find("/**"))
         indent = list(filter(lambda i: i != 0, indent))
         tabsize = round(sum(indent) / len(indent))
 
-    for iblock, doc in enumerate(docstrings):
-        block = doc.split("\n")
+    for iblock in range(len(docstrings)):
+        block = docstrings.get_lines(iblock)
 
         for i in range(1, len(block) - 1):
-            if re.match(r"^(\s*)(\*)(\s\s+)(.*)", block[i]):
-                _, ind, sym, space, rest, _ = re.split(r"^(\s*)(\*)(\s\s+)(.*)", block[i])
-                ex = (len(ind) + len(sym) + len(space)) % tabsize
-                if ex:
-                    block[i] = ind + sym + space + " " * (tabsize - ex) + rest
+            line = block[i]
+            body = line.lstrip()
+            if not body.startswith("*"):
+                continue
+            rest = body[1:].lstrip()
+            if len(body) - len(rest) < 3:  # "*" followed by at least two whitespace characters
+                continue
+            ex = (len(line) - len(rest)) % tabsize
+            if ex:
+                block[i] = line[: len(line) - len(rest)] + " " * (tabsize - ex) + rest
 
-        docstrings[iblock] = "\n".join(block)
+        docstrings.set_lines(iblock, block)
 
     return str(docstrings)
 
 
-class Docstrings:
+@functools.lru_cache(maxsize=16)
+def _compiled_quotes(search: str, ignore_escaped: bool) -> re.Pattern:
     """
-    Class to format docstrings.
-    From this class, one can loop over all docstrings in a file and format them. E.g.::
-
-        docstrings = Docstrings(code)
-
-        for i, doc in enumerate(docstrings):
-            doc = ...
-            docstrings[i] = doc
-
-        formatted_code = str(docstrings)
-
-    :param text: The source code.
-    :param opening: The opening symbol of the docstring (e.g. ``"/**"``).
-    :param closing: The closing symbol of the docstring (e.g. ``"/*"``).
-    :param escape_input: If ``True``, escape the input string (e.g. ``"\"`` becomes ``"\\\"``).
+    Compiled pattern for :py:func:`change_quotes`, the quoted text is captured in the first group.
     """
 
-    def __init__(
-        self,
-        text: str,
-        opening: str = "/\\*\\*\\s*\n",
-        closing: str = r"\*/",
-        escape_input: bool = False,
-    ):
-        newline = [i.span()[0] for i in re.finditer(r"\n", text)]
-        doc_blocks = _comment_blocks(text, opening, closing, escape_input=escape_input)
-
-        if len(doc_blocks) == 0:
-            self.blocks = [text]
-            self.comment = [False]
-            return
-
-        code_blocks = {}
-        last = 0
-        for start_line, end_line in doc_blocks.items():
-            code_blocks[last] = start_line - 1
-            last = end_line
-        code_blocks[last] = -1
-
-        scode = min(code_blocks)
-        ecode = code_blocks[scode]
-
-        if min(doc_blocks) == 0:
-            self.blocks = []
-            self.comment = []
-        elif min(code_blocks) == 0:
-            self.blocks = [text[: newline[ecode]]]  # noqa: E203
-            self.comment = [False]
-        else:
-            self.blocks = [text[newline[scode - 1] + 1 : newline[ecode]]]  # noqa: E203
-            self.comment = [False]
-
-        while True:
-            sdoc = ecode + 1
-            edoc = doc_blocks[sdoc]
-
-            scode = edoc
-            ecode = code_blocks[scode]
-
-            if sdoc == 0:
-                self.blocks.append(text[: newline[edoc - 1]])  # noqa: E203
-            else:
-                self.blocks.append(text[newline[sdoc - 1] + 1 : newline[edoc - 1]])  # noqa: E203
-            self.comment.append(True)
-
-            if ecode == -1:
-                self.blocks.append(text[newline[scode - 1] + 1 :])  # noqa: E203
-                self.comment.append(False)
-                break
-
-            self.blocks.append(text[newline[scode - 1] + 1 : newline[ecode]])  # noqa: E203
-            self.comment.append(False)
-
-        self.index = {}
-        i = 0
-        for j in range(len(self.blocks)):
-            if self.comment[j]:
-                self.index[i] = j
-                i += 1
-
-    def __iter__(self):
-        for i in range(len(self.blocks)):
-            if self.comment[i]:
-                yield self.blocks[i]
-
-    def __setitem__(self, i, value):
-        self.blocks[self.index[i]] = value
-
-    def __getitem__(self, i):
-        return self.blocks[self.index[i]]
+    search = re.escape(search)
+    quote = r"(?<!\\)" + search if ignore_escaped else search
 
-    def __str__(self):
-        return "\n".join(self.blocks)
+    return re.compile(rf"{quote}([^{search}]*){quote}")
 
 
-def change_quotes(text: str, search: str, replace: str, ignore_escaped: bool = True) -> str:
+def change_quotes(
+    text: str,
+    search: str,
+    replace: str,
+    ignore_escaped: bool = True,
+    docstrings: Docstrings = None,
+) -> str:
     r"""
     Change quotes used to quote text in all comment blocks. For example::
 
@@ -340,31 +472,48 @@ def change_quotes(text: str, search: str, replace: str, ignore_escaped: bool = T
     :param search: The quote to search for, e.g. ``'``.
     :param replace: The quote to replace with, e.g. ``'``.
     :param ignore_escaped: Ignore escaped quotes (escaped with \\).
+    :param docstrings: Docstrings of ``text``, modified in place (``text`` is then ignored).
     :return: Source code with changed formatting.
     """
 
-    search = re.escape(search)
-    replace = re.escape(replace)
+    if docstrings is None:
+        if search not in text:
+            return text
+        docstrings = Docstrings(text)
 
-    if ignore_escaped:
-        search = r"(?<!\\)" + search
+    pattern = _compiled_quotes(search, ignore_escaped)
 
-    docstrings = Docstrings(text)
+    def repl(match):
+        return replace + match.group(1) + replace
 
     for i, doc in enumerate(docstrings):
-        docstrings[i] = re.sub(
-            rf"({search})([^{search}]*)({search})", rf"{replace}\2{replace}", doc
-        )
+        docstrings[i] = pattern.sub(repl, doc)
 
     return str(docstrings)
 
 
+def _check_style(style: str, doxygen: str):
+    """
+    Check the formatting options of :py:func:`format`.
+
+    :param style: Style.
+    :param doxygen: Prefix of doxygen commands.
+    """
+
+    if style != "javadoc" or not doxygen:
+        raise ValueError(f"Unknown style: '{style}'")
+
+    if doxygen not in ["@", "\\"]:
+        raise ValueError(f"Unknown doxygen prefix: '{doxygen}'")
+
+
 def format(
     text: str,
     style: str = "javadoc",
     doxygen: str = "@",
     tabsize: int = None,
     align_codeblock: bool = False,
+    docstrings: Docstrings = None,
 ) -> str:
     r"""
     Change formatting of comment blocks. See `doxygen <https://doxygen.nl/manual/docblocks.html>`_.
@@ -373,16 +522,21 @@ def format(
     :param doxygen: Format doxygen commands with certain prefix (``"@", "\"``). False to skip.
     :param tabsize: Specify tabsize.
     :param align_codeblock: Align code blocks inside the comment blocks.
+    :param docstrings: Docstrings of ``text``, modified in place (``text`` is then ignored).
     :return: Formatted text.
     """
 
-    if style == "javadoc" and doxygen:
-        ret = _format_javadoc_doxygen(text, doxygen_prefix=doxygen)
-    else:
-        raise ValueError(f"Unknown style: '{style}'")
+    _check_style(style, doxygen)
+
+    if docstrings is None:
+        if "/**" not in text:
+            return text
+        docstrings = Docstrings(text)
+
+    ret = _format_javadoc_doxygen(text, doxygen_prefix=doxygen, docstrings=docstrings)
 
     if align_codeblock:
-        ret = _format_javadoc_internal_indent(ret, tabsize=tabsize)
+        ret = _format_javadoc_internal_indent(ret, tabsize=tabsize, docstrings=docstrings)
 
     return ret
 
@@ -407,10 +561,30 @@ def _search_upwards_for_file(filename: str) -> pathlib.Path:
     return None
 
 
+def _run_clang_format(source: str, executable: str, filename: pathlib.Path) -> str:
+    """
+    Format a piece of code using clang-format (reading from stdin).
+
+    :param source: Piece of code.
+    :param executable: Path to clang-format executable.
+    :param filename: Filename used to find the style (``.clang-format`` in the same directory).
+    :return: Formatted piece of code (unchanged if clang-format fails, its error is printed).
+    """
+
+    cmd = [executable, f"--assume-filename={filename}"]
+    out = subprocess.run(cmd, input=source, stdout=subprocess.PIPE, text=True)
+
+    if out.returncode != 0:
+        return source
+
+    return out.stdout
+
+
 def clang_format(
     text: str,
     executable: str = "clang-format",
     style: dict = None,
+    docstrings: Docstrings = None,
 ) -> str:
     r"""
     Format code blocks using clang-format.
@@ -425,57 +599,73 @@ def clang_format(
     :param text: Source code.
     :param blocks: List of code blocks.
     :param executable: Path to clang-format executable.
+    :param style: The clang-format style (default: search ``.clang-format`` as clang-format does).
+    :param docstrings: Docstrings of ``text``, modified in place (``text`` is then ignored).
     :return: Source code with formatted code blocks.
     """
 
+    if docstrings is None:
+        if "/**" not in text:
+            return text
+        docstrings = Docstrings(text)
+
     with tempfile.TemporaryDirectory() as tmpdir:
         tempdir = pathlib.Path(tmpdir)
         sourcefile = tempdir / "source.cpp"
 
-        docstrings = Docstrings(text)
-
         if style is not None:
             with open(tempdir / ".clang-format", "w") as file:
                 yaml.dump(style, file)
 
+        blocks = []
+        sources = []
+
         for idoc, doc in enumerate(docstrings):
-            # line number of each character
-            lineno = [0 for _ in range(len(doc))]
-            i = 0
-            line = 0
-            for line, match in enumerate(re.finditer(r"\n", doc)):
-                lineno[i : match.span()[0]] = [line for _ in range(match.span()[0] - i)]
-                i = match.span()[0]
-                lineno[i] = line
-                i += 1
-            lineno[i:] = [line + 1 for _ in range(len(doc) - i)]
-
-            matching = find_matching(
-                doc, r"([\@\\])(code{\.cpp})", r"([\@\\])(endcode)", escape_input=False
-            )
-
-            ret = []
+            matching = _find_matching_compiled(doc, _RE_CODEBLOCK)
+
+            if len(matching) == 0:
+                continue
+
+            codeblocks = []
             doclines = doc.splitlines()
-            prev = 0
 
             for opening, closing in matching.items():
-                ret += doclines[prev : lineno[opening]]
-                prev = lineno[closing] + 1
-
-                target = doclines[lineno[opening] : lineno[closing] + 1]
-                indent = os.path.commonprefix(target)
-                if indent[-1] != " ":
-                    indent += " "
-                target = [line.lstrip(indent) for line in target]
-                source = target[1:-1]
-                sourcefile.write_text("\n".join(source))
-                subprocess.run([executable, "-i", str(sourcefile)])
-                source = sourcefile.read_text()
-                target = [target[0], source, target[-1]]
-                ret += [textwrap.indent("\n".join(target), indent)]
-
-            ret += doclines[prev:]
-            docstrings[idoc] = "\n".join(ret)
+                start_line = doc.count("\n", 0, opening)
+                end_line = start_line + doc.count("\n", opening, closing)
+                target = doclines[start_line : end_line + 1]
+                # width of the comment decoration (whitespace and "*") shared by all non-empty lines
+                width = min(len(i) - len(i.lstrip(" \t*")) for i in target if i.strip(" \t*"))
+                indent = target[0][:width]
+                target = [line[width:] for line in target]
+                sources.append("\n".join(target[1:-1]))
+                codeblocks.append((start_line, end_line, indent, target))
+
+            blocks.append((idoc, doclines, codeblocks))
+
+        # each code block is formatted separately: state (e.g. "// clang-format off") cannot leak
+        run = functools.partial(_run_clang_format, executable=executable, filename=sourcefile)
+
+        if len(sources) > 1:
+            jobs = min(len(sources), os.cpu_count() or 1)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+                formatted = list(executor.map(run, sources))
+        else:
+            formatted = [run(i) for i in sources]
+
+    formatted = iter(formatted)
+
+    for idoc, doclines, codeblocks in blocks:
+        ret = []
+        prev = 0
+
+        for start_line, end_line, indent, target in codeblocks:
+            ret += doclines[prev:start_line]
+            prev = end_line + 1
+            target = [target[0], next(formatted), target[-1]]
+            ret += [textwrap.indent("\n".join(target), indent)]
+
+        ret += doclines[prev:]
+        docstrings[idoc] = "\n".join(ret)
 
     return str(docstrings)
 
@@ -528,11 +718,155 @@ def _format_parser():
         default="clang-format",
         help="Specify clang-format executable.",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes to format files in parallel.",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Cache formatted files (in $XDG_CACHE_HOME/cpp_comment_format) to speed-up reruns.",
+    )
     parser.add_argument("-v", "--version", action="version", version=version)
     parser.add_argument("file", type=str, nargs="*", help="Input file(s).")
     return parser
 
 
+def _decode(data: bytes) -> str:
+    """
+    Decode the content of a file like :py:meth:`pathlib.Path.read_text`
+    (preferred encoding, universal newlines).
+
+    :param data: Content of the file.
+    :return: Text.
+    """
+
+    text = data.decode(locale.getpreferredencoding(False))
+
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+
+    return text
+
+
+def _cache_dir() -> pathlib.Path:
+    """
+    Directory in which formatted files are cached, see ``--cache``.
+    """
+
+    root = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return pathlib.Path(root) / "cpp_comment_format"
+
+
+def _cache_key(data: bytes, args: argparse.Namespace) -> str:
+    """
+    Cache key of a file: hash of its content, of the version of this tool, and of all options
+    (including the clang-format style and version) that affect the formatting.
+
+    :param data: Content of the file.
+    :param args: Parsed command-line arguments.
+    :return: Hexadecimal digest.
+    """
+
+    options = [
+        version,
+        args.style,
+        args.doxygen,
+        args.tabsize,
+        args.code_block,
+        args.change_quote,
+        args.clang_format,
+    ]
+
+    if args.clang_format:
+        options += [args.clang_format_executable, args.clang_format_version]
+        options += [args.clang_format_style]
+
+    h = hashlib.sha256(repr(options).encode())
+    h.update(data)
+    return h.hexdigest()
+
+
+def _cli_format_text(text: str, args: argparse.Namespace) -> str:
+    """
+    Format source code according to the command-line arguments, see :py:func:`cli_format`.
+
+    :param text: Source code.
+    :param args: Parsed command-line arguments.
+    :return: Formatted source code.
+    """
+
+    docstrings = Docstrings(text)
+    ret = format(
+        text,
+        style=args.style,
+        doxygen=args.doxygen,
+        tabsize=args.tabsize,
+        align_codeblock=args.code_block,
+        docstrings=docstrings,
+    )
+    if args.change_quote:
+        for search, replace in args.change_quote:
+            ret = change_quotes(ret, search, replace, docstrings=docstrings)
+    if args.clang_format:
+        style = args.clang_format_style
+        ret = clang_format(ret, args.clang_format_executable, style, docstrings=docstrings)
+    return ret
+
+
+def _cli_format_file(file: str, args: argparse.Namespace) -> str:
+    """
+    Format a file according to the command-line arguments, see :py:func:`cli_format`.
+
+    :param file: Input file.
+    :param args: Parsed command-line arguments.
+    :return: Formatted source code (``None`` if the file is formatted in place).
+    """
+
+    path = pathlib.Path(file)
+    data = path.read_bytes()
+
+    if b"/**" not in data:
+        return None if args.in_place else _decode(data)
+
+    inp = _decode(data)
+
+    if not args.cache:
+        ret = _cli_format_text(inp, args)
+    else:
+        cache = _cache_dir() / _cache_key(data, args)
+        if cache.is_file():
+            ret = cache.read_text()
+        else:
+            ret = _cli_format_text(inp, args)
+            cache.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", dir=cache.parent, delete=False) as f:
+                f.write(ret)
+            os.replace(f.name, cache)  # atomic: files may be formatted in parallel
+
+    if not args.in_place:
+        return ret
+
+    if inp != ret:
+        path.write_text(ret)
+
+
+def _print_formatted(rets: Iterable[str]):
+    """
+    Print formatted files as soon as they are available, in the order of the input files.
+
+    :param rets: Formatted source code per file (``None`` for files formatted in place).
+    """
+
+    for ret in rets:
+        if ret is not None:
+            sys.stdout.write(ret)
+            sys.stdout.write("\n")
+
+
 def cli_format(args: list[str]):
     """
     Command-line tool to print datasets from a file, see ``--help``.
@@ -542,30 +876,28 @@ def cli_format(args: list[str]):
 
     parser = _format_parser()
     args = parser.parse_args(args)
+    _check_style(args.style, args.doxygen)  # files without docstrings are not formatted
 
-    for file in args.file:
-        with open(file) as f:
-            inp = f.read()
-            ret = format(
-                inp,
-                style=args.style,
-                doxygen=args.doxygen,
-                tabsize=args.tabsize,
-                align_codeblock=args.code_block,
-            )
-            if args.change_quote:
-                for search, replace in args.change_quote:
-                    ret = change_quotes(ret, search, replace)
-            if args.clang_format:
-                style = _search_upwards_for_file(".clang-format")
-                if style is not None:
-                    style = yaml.load(style.read_text(), Loader=yaml.FullLoader)
-                ret = clang_format(ret, args.clang_format_executable, style)
-            if args.in_place and inp != ret:
-                with open(file, "w") as f:
-                    f.write(ret)
-            elif not args.in_place:
-                print(ret)
+    # resolve the clang-format style (and version, which is part of the cache key) once
+    if args.clang_format:
+        style = _search_upwards_for_file(".clang-format")
+        if style is not None:
+            style = yaml.load(style.read_text(), Loader=yaml.FullLoader)
+        args.clang_format_style = style
+        if args.cache:
+            cmd = [args.clang_format_executable, "--version"]
+            out = subprocess.run(cmd, stdout=subprocess.PIPE, text=True)
+            args.clang_format_version = out.stdout
+    formatter = functools.partial(_cli_format_file, args=args)
+
+    chunksize = 4  # files per task sent to a worker
+    jobs = min(args.jobs, math.ceil(len(args.file) / chunksize))
+
+    if jobs > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            _print_formatted(executor.map(formatter, args.file, chunksize=chunksize))
+    else:
+        _print_formatted(map(formatter, args.file))
 
 
 def _cli():
@@ -34,3 +34,50 @@ int foo(int a);
 
     ret = cpp_comment_format.clang_format(code)
     assert formatted.strip() == ret.strip()
+
+
+def test_independent_blocks():
+    code = """
+/**
+ * @code{.cpp}
+ * // clang-format off
+ * int   a=0;
+ * @endcode
+ *
+ * @code{.cpp}
+ * int   b=1;
+ * @endcode
+ */
+int foo(int a);
+"""
+
+    formatted = """
+/**
+ * @code{.cpp}
+ * // clang-format off
+ * int   a=0;
+ * @endcode
+ *
+ * @code{.cpp}
+ * int b = 1;
+ * @endcode
+ */
+int foo(int a);
+"""
+
+    ret = cpp_comment_format.clang_format(code)
+    assert formatted.strip() == ret.strip()
+
+
+def test_clang_format_error():
+    code = """
+/**
+ * @code{.cpp}
+ * int   a=0;
+ * @endcode
+ */
+int foo(int a);
+"""
+
+    ret = cpp_comment_format.clang_format(code, style={"SomeUnknownOption": True})
+    assert code == ret
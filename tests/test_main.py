@@ -3,6 +3,27 @@ import pytest
 import cpp_comment_format
 
 
+def test_find_matching():
+    assert cpp_comment_format.find_matching("(a)(b)", "(", ")") == {0: 2, 3: 5}
+    assert cpp_comment_format.find_matching(")(a)", "(", ")") == {1: 3}
+    assert cpp_comment_format.find_matching(r"(\)a)", "(", ")") == {0: 4}
+    assert cpp_comment_format.find_matching("x", "(", ")") == {}
+
+    ret = cpp_comment_format.find_matching("((a)(b))", "(", ")")
+    assert ret == {0: 7, 1: 3, 4: 6}
+    assert list(ret) == [0, 1, 4]
+
+    ret = cpp_comment_format.find_matching("/** a */ /** b */", "/**", "*/")
+    assert ret == {0: 6, 9: 15}
+    assert cpp_comment_format.find_matching("int a; /**/", "/**", "*/") == {7: 9}
+    assert cpp_comment_format.find_matching("/**/ /** a */", "/**", "*/") == {0: 2, 5: 11}
+    assert cpp_comment_format.find_matching("/**/", "/**", "*/") == {0: 2}
+    assert cpp_comment_format.find_matching("/**/", r"/\*\*", r"\*/", escape_input=False) == {0: 2}
+
+    with pytest.raises(IndexError):
+        cpp_comment_format.find_matching("(a", "(", ")")
+
+
 def test_Docstrings_basic():
     code = """
 /**
@@ -37,6 +58,22 @@ int foo(int a);
     assert code == str(cpp_comment_format.Docstrings(code))
 
 
+def test_Docstrings_adjacent():
+    code = """
+/**
+ * My first docstring.
+ */
+/**
+ * My second docstring.
+ */
+int foo(int a);""".lstrip()
+
+    docs = cpp_comment_format.Docstrings(code)
+    assert len(docs) == 2
+    assert docs.get_lines(1) == ["/**", " * My second docstring.", " */"]
+    assert code == str(docs)
+
+
 def test_Docstrings():
     docstrings = [
         """
@@ -109,7 +146,6 @@ def test_quotes():
     assert cpp_comment_format.change_quotes(code, "``", "`").strip() == formatted.strip()
 
 
-@pytest.mark.skip(reason="todo: fix bug")
 def test_quotes_bug():
     code = """
 /**
@@ -119,10 +155,10 @@ def test_quotes_bug():
 """
 
     formatted = """
- /**
-  * This is a docstring.
-  * square box with edge-size `(2 * size + 1) * h`, around `element`.
-  */
+/**
+ * This is a docstring.
+ * square box with edge-size `(2 * size + 1) * h`, around `element`.
+ */
 """
 
     assert cpp_comment_format.change_quotes(code, "``", "`") == formatted
@@ -244,6 +280,38 @@ def test_javadoc_doxygen_4():
     assert cpp_comment_format.format(ret, style="javadoc", doxygen="@") == expected
 
 
+def test_javadoc_doxygen_keys():
+    text = r"""
+/**
+ * \brief This is a docstring.
+ *
+ * \tparam T This is a template parameter.
+ * \param a This is a parameter.
+ * \returns This is a return value.
+ * \throws std::runtime_error
+ * \warning This is a warning.
+ */
+int foo(int a);
+"""
+
+    expected = """
+/**
+ * @brief This is a docstring.
+ *
+ * @tparam T This is a template parameter.
+ * @param a This is a parameter.
+ * @returns This is a return value.
+ * @throws std::runtime_error
+ * @warning This is a warning.
+ */
+int foo(int a);
+"""
+
+    ret = cpp_comment_format.format(text, style="javadoc", doxygen="@")
+    assert ret == expected
+    assert cpp_comment_format.format(ret, style="javadoc", doxygen="\\") == text
+
+
 def test_mixed_style():
     text = r"""
 /**
@@ -302,3 +370,100 @@ def test_indentation():
     ret = cpp_comment_format.format(text, style="javadoc", doxygen="@", align_codeblock=True)
     assert ret == expected
     assert cpp_comment_format.format(ret, style="javadoc", doxygen="@") == expected
+
+
+def test_cli_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+
+    text = r"""
+/**
+This is a docstring.
+
+\param a This is a parameter.
+*/
+int foo(int a);
+"""
+
+    expected = """
+/**
+ * This is a docstring.
+ *
+ * @param a This is a parameter.
+ */
+int foo(int a);
+"""
+
+    file = tmp_path / "foo.h"
+    cache = tmp_path / "cache" / "cpp_comment_format"
+
+    file.write_text(text)
+    cpp_comment_format.cli_format(["-i", "--cache", str(file)])
+    assert file.read_text() == expected
+    assert len(list(cache.iterdir())) == 1
+
+    def raise_on_format(*args, **kwargs):
+        raise AssertionError("cache not used")
+
+    monkeypatch.setattr(cpp_comment_format, "_cli_format_text", raise_on_format)
+    file.write_text(text)
+    cpp_comment_format.cli_format(["-i", "--cache", str(file)])
+    assert file.read_text() == expected
+    assert len(list(cache.iterdir())) == 1
+
+    monkeypatch.undo()
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    file.write_text(text)
+    cpp_comment_format.cli_format(["-i", "--cache", "-d", "\\", str(file)])
+    assert file.read_text() == expected.replace("@param", "\\param")
+    assert len(list(cache.iterdir())) == 2
+
+    args = cpp_comment_format._format_parser().parse_args(["--clang-format", str(file)])
+    args.clang_format_style = None
+    args.clang_format_version = "clang-format version 17.0.0"
+    key = cpp_comment_format._cache_key(b"", args)
+    args.clang_format_version = "clang-format version 18.0.0"
+    assert key != cpp_comment_format._cache_key(b"", args)
+
+
+def test_cli_style(tmp_path):
+    file = tmp_path / "foo.h"
+    file.write_text("int foo(int a);\n")
+
+    with pytest.raises(ValueError):
+        cpp_comment_format.cli_format(["-s", "bogus", str(file)])
+
+    with pytest.raises(ValueError):
+        cpp_comment_format.cli_format(["-i", "-d", "#", str(file)])
+
+
+def test_cli_jobs(tmp_path, capsys):
+    text = r"""
+/**
+Docstring {0:d}.
+
+\param a This is a parameter.
+*/
+int foo{0:d}(int a);
+"""
+
+    expected = """
+/**
+ * Docstring {0:d}.
+ *
+ * @param a This is a parameter.
+ */
+int foo{0:d}(int a);
+"""
+
+    files = [tmp_path / f"foo{i:d}.h" for i in range(10)]
+
+    for i, file in enumerate(files):
+        file.write_text(text.format(i))
+
+    cpp_comment_format.cli_format(["-j", "2", *map(str, files)])
+    assert capsys.readouterr().out == "".join(expected.format(i) + "\n" for i in range(10))
+
+    cpp_comment_format.cli_format(["-j", "2", "-i", *map(str, files)])
+
+    for i, file in enumerate(files):
+        assert file.read_text() == expected.format(i)